@@ -3,16 +3,85 @@
 淘宝直播间弹幕监听器 - 统一版本
 统一接口风格，与抖音版本保持一致
 """
+import os
 import re
+import logging
 import time
 import json
 import hashlib
 import threading
-import random
 import requests
-import base64
-from urllib.parse import urlparse, parse_qs, unquote
-from playwright.sync_api import sync_playwright
+from binascii import a2b_base64
+from collections import OrderedDict
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import unquote_plus, quote, urlencode
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖, 未安装时回退到标准库json
+    orjson = None
+
+if orjson is not None:
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+else:
+    def _loads(data):
+        """标准库json不接受memoryview, 直接从缓冲区解码为str, 与orjson.loads保持一致"""
+        if isinstance(data, memoryview):
+            data = str(data, 'utf-8')
+        return json.loads(data)
+
+    def _dumps(obj):
+        """紧凑格式序列化为UTF-8字节串, 与orjson.dumps保持一致"""
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+# 预编译正则
+_LIVE_ID_RE = re.compile(r'liveId=(\d+)')
+_TOPIC_RE = re.compile(r'"topic"\s*:\s*"([^"]+)"')
+_DATA_PARAM_RE = re.compile(r'[?&]data=([^&#]+)')
+_DIGIT_RE = re.compile(r'\d+')
+_JSON_TOKEN_RE = re.compile(rb'[{}"\\]')
+_GIFT_KEYWORDS = ('送出了', '打赏了', '礼物', '小心心', '棒棒糖')
+_GIFT_RE = re.compile('|'.join(map(re.escape, _GIFT_KEYWORDS)))
+_COMMENT_QUERY_DATA_RE = re.compile(r'mtop\.taobao\.iliad\.comment\.query\.latest[^"\']*?[?&]data=([^&"\']+)')
+
+
+def _topic_from_data_param(raw):
+    """从URL编码的mtop data参数中取出topic"""
+    try:
+        return _loads(unquote_plus(raw)).get('topic')
+    except (ValueError, AttributeError):
+        return None
+
+
+def _mtop_base_url(api, app_key):
+    """拼接mtop接口URL及其固定查询参数, 每次请求只需追加t/sign/data"""
+    query = urlencode({
+        'jsv': '2.7.2', 'appKey': app_key, 'api': api, 'v': '1.0',
+        'preventFallback': 'true', 'type': 'originaljson', 'dataType': 'json'
+    })
+    return f'https://h5api.m.taobao.com/h5/{api}/1.0/?{query}'
+
+
+# mtop接口
+_COMMENT_APP_KEY = '34675810'
+_COMMENT_URL = _mtop_base_url('mtop.taobao.iliad.comment.query.latest', _COMMENT_APP_KEY)
+_HEARTBEAT_APP_KEY = '12574478'
+_HEARTBEAT_URL = _mtop_base_url('mtop.taobao.powermsg.h5.msg.pullnativemsg', _HEARTBEAT_APP_KEY)
+# 心跳data中offset之后的固定字段, 字段顺序与原dict序列化结果一致
+_HEARTBEAT_DATA_TAIL = b',"pagesize":10,"tag":"","bizcode":1,"sdkversion":"h5_3.4.2","role":3}'
+# 出现这些错误码说明token/cookies已失效, 需要重新获取
+_TOKEN_INVALID_CODES = ('FAIL_SYS_TOKEN_EXOIRED', 'FAIL_SYS_TOKEN_EXPIRED', 'FAIL_SYS_ILLEGAL_ACCESS', 'ILLEGAL_ACCESS')
+
+# 浏览器回退时不加载的资源类型, topic只依赖页面脚本发出的评论请求
+_BLOCKED_RESOURCE_TYPES = frozenset({'image', 'media', 'font', 'stylesheet'})
+
+# topic/cookies磁盘缓存目录
+_CREDS_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'taobao_live')
 
 
 class ProtobufMessageParser:
@@ -22,56 +91,57 @@ class ProtobufMessageParser:
     def parse_base64_message(base64_data):
         """解析base64编码的混合格式消息"""
         try:
-            decoded_bytes = base64.b64decode(base64_data)
+            decoded_bytes = a2b_base64(base64_data)
+            # 通过memoryview切片取出各JSON片段, 不为每个片段复制一份bytes
+            view = memoryview(decoded_bytes)
             json_objects = []
             current_pos = 0
+            search_token = _JSON_TOKEN_RE.search
             
             while current_pos < len(decoded_bytes):
-                json_start = -1
-                for i in range(current_pos, len(decoded_bytes)):
-                    if decoded_bytes[i] == 0x7B:
-                        json_start = i
-                        break
-                
+                json_start = decoded_bytes.find(b'{', current_pos)
                 if json_start == -1:
                     break
-                
+
+                # 只在结构字符之间跳转, 不逐字节解释执行
                 brace_count = 0
                 in_string = False
-                escaped = False
                 json_end = -1
-                
-                for i in range(json_start, len(decoded_bytes)):
-                    char = chr(decoded_bytes[i]) if decoded_bytes[i] < 128 else '?'
-                    
-                    if not in_string:
-                        if char == '{':
-                            brace_count += 1
-                        elif char == '}':
-                            brace_count -= 1
-                        elif char == '"':
-                            in_string = True
-                    else:
-                        if escaped:
-                            escaped = False
-                        elif char == '\\':
-                            escaped = True
-                        elif char == '"':
-                            in_string = False
-                    
-                    if brace_count == 0 and i > json_start:
-                        json_end = i
+                pos = json_start
+
+                while True:
+                    match = search_token(decoded_bytes, pos)
+                    if match is None:
                         break
-                
+                    i = match.start()
+                    char = decoded_bytes[i]
+                    pos = i + 1
+
+                    if in_string:
+                        if char == 0x5C:  # 反斜杠, 跳过被转义的下一个字节
+                            pos += 1
+                        elif char == 0x22:
+                            in_string = False
+                    elif char == 0x7B:
+                        brace_count += 1
+                    elif char == 0x7D:
+                        brace_count -= 1
+                        if brace_count == 0:
+                            json_end = i
+                            break
+                    elif char == 0x22:
+                        in_string = True
+
                 if json_end != -1:
-                    json_bytes = decoded_bytes[json_start:json_end + 1]
-                    json_string = json_bytes.decode('utf-8', errors='ignore')
-                    
+                    json_bytes = view[json_start:json_end + 1]
                     try:
-                        json_obj = json.loads(json_string)
-                        json_objects.append(json_obj)
-                    except json.JSONDecodeError:
-                        pass
+                        json_objects.append(_loads(json_bytes))
+                    except ValueError:
+                        # 含非法UTF-8字节时, 去掉这些字节后再试一次
+                        try:
+                            json_objects.append(_loads(str(json_bytes, 'utf-8', 'ignore')))
+                        except ValueError:
+                            pass
                     
                     current_pos = json_end + 1
                 else:
@@ -80,21 +150,28 @@ class ProtobufMessageParser:
             return {'json_objects': json_objects, 'raw_bytes': decoded_bytes}
             
         except Exception as e:
-            print(f"【X】解析protobuf消息失败: {e}")
+            logger.warning("【X】解析protobuf消息失败: %s", e)
             return None
 
 
 class TaobaoLiveWebFetcher:
-    
-    def __init__(self, live_id):
+
+    # protobuf消息subType -> 解析函数名
+    _SUBTYPE_HANDLERS = {
+        10001: '_parseChatMsg',
+        10002: '_parseGiftMsg',
+    }
+
+    def __init__(self, live_id, browser_fallback=True):
         """
         淘宝直播间弹幕抓取对象
         :param live_id: 直播间的ID或URL
+        :param browser_fallback: HTTP方式获取topic失败时, 是否回退到Playwright浏览器
         """
         # 处理输入参数
         if 'taobao.com' in str(live_id):
             self.live_url = live_id
-            match = re.search(r'liveId=(\d+)', live_id)
+            match = _LIVE_ID_RE.search(live_id)
             self.live_id = match.group(1) if match else None
         else:
             self.live_id = str(live_id)
@@ -106,21 +183,60 @@ class TaobaoLiveWebFetcher:
             'Chrome/136.0.0.0 Safari/537.36'
         )
 
+        self.browser_fallback = browser_fallback
         self.topic = None
         self.cookie_dict = None
-        self.session = None
+        # 会话在整个生命周期内复用, 重连时只刷新cookies, 保持连接池与keep-alive
+        self.session = self._create_session()
         self.protobuf_parser = ProtobufMessageParser()
 
+        # 当前_m_h5_tk, 连接时从cookies取得, 响应下发新值时更新, 避免每次签名遍历cookie jar
+        self._m_h5_tk = ''
+        # 签名缓存: (_m_h5_tk, token)、(token, token前缀的MD5中间状态) 及各appKey的编码字节
+        self._cached_tk = (None, None)
+        self._md5_prefix = (None, None)
+        self._sign_app_key_bytes = {}
+
+        # topic/cookies缓存有效期(秒)
+        self._creds_max_age = 3600
+
+        # 评论请求数据模板, 每次请求只更新topic/paginationContext
+        self._comment_payload = {"topic": None, "limit": 20, "tab": 2, "order": "asc"}
+
         # 连接控制
         self._stop_event = threading.Event()
         self._connection_thread = None
-        self._heartbeat_thread = None
+        # Playwright回退路径的浏览器, 首次使用时启动, 由连接线程持有并在其退出时关闭
+        self._playwright = None
+        self._browser = None
+        self._browser_context = None
         self._reconnect_delay = 1
         self._max_reconnect_delay = 60
         self._pagination_ctx = None
-        self._last_message_time = time.time()
+        # 分页上下文超过该长度时丢弃, 由服务端重新开始分页
+        self._max_pagination_ctx_len = 4096
+        # 最近处理过的评论ID, 重连或分页窗口重叠时丢弃重复评论
+        self._seen_comment_ids = OrderedDict()
+        self._seen_comment_cap = 2048
+        # 最近处理过的心跳消息data, 相邻拉取返回重叠消息时跳过重复解码
+        self._seen_msg_data = OrderedDict()
+        self._seen_msg_data_cap = 256
+        # 批量输出缓冲, 仅在_batched_output期间不为None
+        self._out_batch = None
+        # 心跳与评论轮询在同一线程内交替进行: 心跳按固定间隔发送,
+        # 心跳拉到新消息时提前拉取评论, 否则评论按自适应间隔轮询(不超过兜底间隔)
         self._heartbeat_interval = 10
-        self._no_message_timeout = 30
+        self._next_heartbeat_time = 0.0
+        self._comment_fallback_interval = 30
+        self._poll_interval = 0.0
+        # 心跳data中只有offset会变化, 预先序列化其余部分, 每次只拼接offset
+        self._heartbeat_head = b''
+        self._heartbeat_offset = None
+        self._heartbeat_headers = {
+            'x-biz-type': 'powermsg',
+            'x-biz-info': 'namespace=1',
+            'referer': f'https://tbzb.taobao.com/live?liveId={self.live_id}' if self.live_id else 'https://tbzb.taobao.com/'
+        }
 
     def start(self):
         """启动监听"""
@@ -132,8 +248,9 @@ class TaobaoLiveWebFetcher:
         self._connection_thread.start()
         
         try:
-            while not self._stop_event.is_set():
-                time.sleep(1)
+            # 带超时等待: 无超时的wait在Windows上无法被Ctrl+C打断
+            while not self._stop_event.wait(timeout=1):
+                pass
         except KeyboardInterrupt:
             self.stop()
 
@@ -143,8 +260,6 @@ class TaobaoLiveWebFetcher:
         self._stop_event.set()
         if self._connection_thread and self._connection_thread.is_alive():
             self._connection_thread.join(timeout=5)
-        if self._heartbeat_thread and self._heartbeat_thread.is_alive():
-            self._heartbeat_thread.join(timeout=5)
         if self.session:
             self.session.close()
 
@@ -157,75 +272,199 @@ class TaobaoLiveWebFetcher:
 
     def _run_connection_loop(self):
         """连接循环管理"""
-        while not self._stop_event.is_set():
-            try:
-                self._connect_and_listen()
-                if not self._stop_event.is_set():
-                    self._handle_reconnect("连接结束")
-                else:
-                    break
-            except Exception as e:
-                if not self._stop_event.is_set():
-                    self._handle_reconnect(f"错误: {e}")
-                else:
-                    break
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    self._connect_and_listen()
+                    if not self._stop_event.is_set():
+                        self._handle_reconnect("连接结束")
+                    else:
+                        break
+                except Exception as e:
+                    if not self._stop_event.is_set():
+                        self._handle_reconnect(f"错误: {e}")
+                    else:
+                        break
+        finally:
+            # Playwright同步API对象只能在创建它的线程中使用, 因此在连接线程退出时关闭浏览器
+            self._close_browser()
 
     def _handle_reconnect(self, reason):
         """处理重连"""
         if self._stop_event.is_set():
             return
+        logger.info("【X】连接中断(%s), %s秒后重连", reason, self._reconnect_delay)
         self._stop_event.wait(timeout=self._reconnect_delay)
         self._reconnect_delay = min(self._reconnect_delay * 2, self._max_reconnect_delay)
 
     def _connect_and_listen(self):
         """连接和监听主逻辑"""
         try:
-            self.topic, self.cookie_dict = self.get_topic_and_cookies()
-            self.session = requests.Session()
-            self.session.headers.update({'User-Agent': self.user_agent})
-            self.session.cookies.update(self.cookie_dict)
-            
-            # 启动心跳线程
-            self._heartbeat_thread = threading.Thread(target=self._sendHeartbeat, daemon=True)
-            self._heartbeat_thread.start()
-            
-            self._last_message_time = time.time()
+            topic, cookie_dict = self._load_cached_creds()
+            if topic:
+                self.topic, self.cookie_dict = topic, cookie_dict
+            else:
+                self.topic, self.cookie_dict = self.get_topic_and_cookies()
+                self._save_cached_creds()
+            self.session.cookies.clear()
+            for name, value in self.cookie_dict.items():
+                # 与服务端Set-Cookie使用相同domain/path, 轮换token时覆盖而不是并存
+                self.session.cookies.set(name, value, domain='.taobao.com', path='/')
+            self._m_h5_tk = self.cookie_dict.get('_m_h5_tk', '')
+
+            # 心跳请求数据前缀, 每次只更新offset; 首次心跳紧随首次评论拉取
+            self._heartbeat_head = b'{"topic":' + _dumps(self.topic) + b',"offset":'
+            self._heartbeat_offset = str(int(time.time() * 1000))
+            self._next_heartbeat_time = 0.0
             self._reconnect_delay = 1
-            
+
             # 开始监听
             self._listen_comments()
             
         except Exception as e:
             raise
 
+    def _creds_cache_path(self):
+        """topic/cookies缓存文件路径, 无直播间ID时不缓存"""
+        if not self.live_id:
+            return None
+        return os.path.join(_CREDS_CACHE_DIR, f"{self.live_id}.json")
+
+    def _load_cached_creds(self):
+        """读取未过期的topic/cookies缓存, 不可用时返回(None, None)"""
+        path = self._creds_cache_path()
+        if not path:
+            return None, None
+        try:
+            with open(path, 'rb') as f:
+                cached = _loads(f.read())
+            if time.time() - cached.get('saved_at', 0) > self._creds_max_age:
+                return None, None
+            topic, cookies = cached.get('topic'), cached.get('cookies')
+            if not topic or not cookies or not self._is_token_fresh(cookies.get('_m_h5_tk', '')):
+                return None, None
+        except OSError:
+            return None, None
+        except (ValueError, TypeError, AttributeError):
+            # 缓存内容损坏或字段类型不对, 删除后重新获取
+            self._invalidate_cached_creds()
+            return None, None
+        return topic, cookies
+
+    def _is_token_fresh(self, m_h5_tk, margin=60):
+        """_m_h5_tk格式为{token}_{过期时间毫秒}, 距过期不足margin秒视为失效; 无法解析时不作判断"""
+        expiry_ms = m_h5_tk.rpartition('_')[2]
+        if not expiry_ms.isdigit():
+            return bool(m_h5_tk)
+        return int(expiry_ms) / 1000 - time.time() > margin
+
+    def _save_cached_creds(self):
+        """保存当前topic/cookies到磁盘缓存"""
+        path = self._creds_cache_path()
+        if not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            tmp_path = path + '.tmp'
+            # 缓存中含会话token, 只允许当前用户读写
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_dumps({'topic': self.topic, 'cookies': self.cookie_dict, 'saved_at': time.time()}))
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def _invalidate_cached_creds(self):
+        """删除topic/cookies磁盘缓存"""
+        path = self._creds_cache_path()
+        if not path:
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _create_session(self):
+        """创建HTTP会话, 心跳与评论轮询共用同一个长连接池"""
+        session = requests.Session()
+        # 心跳与评论在同一线程内串行请求h5api.m.taobao.com, 单个keep-alive连接即可
+        # 读超时不重试: 轮询循环自带重试, 一次卡住的请求不应阻塞评论轮询和stop()
+        retry = Retry(total=3, read=0, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=retry)
+        session.mount('https://', adapter)
+        session.headers.update({'User-Agent': self.user_agent, 'Connection': 'keep-alive'})
+        return session
+
     def get_topic_and_cookies(self):
-        """获取topic和cookies"""
+        """获取topic和cookies, 优先直接HTTP请求, 失败时按需回退到浏览器"""
+        try:
+            topic, cookie_dict = self._bootstrap_http()
+        except requests.RequestException:
+            topic, cookie_dict = None, None
+        if topic:
+            return topic, cookie_dict
+        if not self.browser_fallback:
+            raise ValueError("【X】未能获取到topic")
+        return self._bootstrap_browser()
+
+    def _bootstrap_http(self):
+        """不启动浏览器, 从直播页HTML中提取topic, 并通过一次mtop预请求拿到token cookies"""
+        session = self._create_session()
+        try:
+            resp = session.get(self.live_url, timeout=10)
+            topic = self._extract_topic(resp.text)
+            if not topic:
+                return None, None
+
+            # 不带token的mtop请求会返回FAIL_SYS_TOKEN_EMPTY, 同时下发_m_h5_tk/_m_h5_tk_enc
+            session.get(self._signed_url(_COMMENT_URL, _COMMENT_APP_KEY, b'{}', token=''), timeout=10)
+            cookie_dict = {
+                name: value for name, value in session.cookies.get_dict().items()
+                if name in ['_m_h5_tk', '_m_h5_tk_enc']
+            }
+            if '_m_h5_tk' not in cookie_dict:
+                return None, None
+            return topic, cookie_dict
+        finally:
+            session.close()
+
+    def _extract_topic(self, html):
+        """从直播页HTML中提取topic: 先找内嵌的topic字段, 再找页面中预置的评论接口URL"""
+        match = _TOPIC_RE.search(html)
+        if match:
+            return match.group(1)
+        match = _COMMENT_QUERY_DATA_RE.search(html)
+        if match:
+            return _topic_from_data_param(match.group(1))
+        return None
+
+    def _bootstrap_browser(self):
+        """通过Playwright打开直播页, 拦截评论请求获取topic和cookies"""
         topic = None
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context(user_agent=self.user_agent)
-
-            def handle_request(request):
-                nonlocal topic
-                url = request.url
-                if 'mtop.taobao.iliad.comment.query.latest' in url and not topic:
-                    qs = parse_qs(urlparse(url).query)
-                    data_str = qs.get('data', [''])[0]
-                    try:
-                        data = json.loads(unquote(data_str))
-                        topic = data.get('topic')
-                    except:
-                        pass
-
-            context.on('request', handle_request)
-            page = context.new_page()
-            page.goto(self.live_url, timeout=15000)
-            for _ in range(10):
-                if topic:
-                    break
-                time.sleep(1)
+
+        def handle_request(request):
+            nonlocal topic
+            if topic:
+                return
+            url = request.url
+            if 'mtop.taobao.iliad.comment.query.latest' not in url:
+                return
+            match = _DATA_PARAM_RE.search(url)
+            if match:
+                topic = _topic_from_data_param(match.group(1))
+
+        context = self._ensure_browser_context()
+        page = context.new_page()
+        try:
+            page.on('request', handle_request)
+            page.goto(self.live_url, timeout=15000, wait_until='domcontentloaded')
+            # sync API的事件回调只在调用Playwright期间派发, 用wait_for_timeout短步等待而非time.sleep
+            deadline = time.monotonic() + 10
+            while not topic and time.monotonic() < deadline:
+                page.wait_for_timeout(100)
             cookies = context.cookies()
-            browser.close()
+        finally:
+            page.close()
 
         if not topic:
             raise ValueError("【X】未能获取到topic")
@@ -233,74 +472,99 @@ class TaobaoLiveWebFetcher:
         cookie_dict = {c['name']: c['value'] for c in cookies if c['name'] in ['_m_h5_tk', '_m_h5_tk_enc']}
         return topic, cookie_dict
 
-    def make_sign(self, m_h5_tk, t, app_key, data_str):
-        """生成签名"""
-        token = m_h5_tk.split('_', 1)[0]
-        s = f"{token}&{t}&{app_key}&{data_str}"
-        return hashlib.md5(s.encode('utf-8')).hexdigest()
+    def _ensure_browser_context(self):
+        """启动或复用浏览器上下文, 重连时免去Chromium冷启动; 不使用磁盘profile, 多进程监听同一直播间互不影响"""
+        if self._browser_context is not None and not self._browser.is_connected():
+            # Chromium已崩溃或被杀掉, 丢弃旧浏览器后重新启动
+            logger.info("【X】浏览器连接已断开, 重新启动")
+            self._close_browser()
+        if self._browser_context is None:
+            from playwright.sync_api import sync_playwright
 
-    def _sendHeartbeat(self):
-        """发送心跳包 - 统一函数名"""
-        url = "https://h5api.m.taobao.com/h5/mtop.taobao.powermsg.h5.msg.pullnativemsg/1.0/"
-        app_key = "12574478"
-        offset = str(int(time.time() * 1000))
-        headers = {
-            'x-biz-type': 'powermsg',
-            'x-biz-info': 'namespace=1',
-            'referer': f'https://tbzb.taobao.com/live?liveId={self.live_id}' if self.live_id else 'https://tbzb.taobao.com/'
-        }
-
-        while not self._stop_event.is_set():
+            self._playwright = sync_playwright().start()
             try:
-                now = time.time()
-                if now - self._last_message_time > self._no_message_timeout:
-                    break
-
-                t = str(int(time.time() * 1000))
-                data = {
-                    "topic": self.topic,
-                    "offset": offset,
-                    "pagesize": 10,
-                    "tag": "",
-                    "bizcode": 1,
-                    "sdkversion": "h5_3.4.2",
-                    "role": 3
-                }
-                data_str = json.dumps(data, separators=(',', ':'))
-                sign = self.make_sign(self.session.cookies.get('_m_h5_tk', ''), t, app_key, data_str)
-                params = {
-                    'jsv': '2.7.2', 'appKey': app_key, 't': t, 'sign': sign,
-                    'api': 'mtop.taobao.powermsg.h5.msg.pullnativemsg', 'v': '1.0',
-                    'preventFallback': 'true', 'type': 'jsonp', 'dataType': 'jsonp',
-                    'callback': f'mtopjsonp{random.randint(1,100)}', 'data': data_str
-                }
-
-                resp = self.session.get(url, params=params, headers=headers, timeout=10)
-                text = resp.text
-                json_str = text[text.find('(')+1:text.rfind(')')]
-                result = json.loads(json_str)
-
-                timestamps = result.get('data', {}).get('timestampList', [])
-                
-                if timestamps:
-                    offset = timestamps[-1].get('offset', offset)
-                    for timestamp_data in timestamps:
-                        self._parse_protobuf_message(timestamp_data)
-                    self._last_message_time = time.time()
-                    print("【√】发送心跳包")  # 统一输出格式
-
-                time_to_wait = self._heartbeat_interval
-                while time_to_wait > 0 and not self._stop_event.is_set():
-                    sleep_duration = min(time_to_wait, 1.0)
-                    woken_up = self._stop_event.wait(timeout=sleep_duration)
-                    if woken_up:
-                        break
-                    time_to_wait -= sleep_duration
+                self._browser = self._playwright.chromium.launch(headless=True)
+                self._browser_context = self._browser.new_context(user_agent=self.user_agent)
+                self._browser_context.route('**/*', self._route_browser_request)
+            except Exception:
+                self._close_browser()
+                raise
+        return self._browser_context
+
+    def _route_browser_request(self, route):
+        """拦截图片/媒体/字体/样式请求, 加快页面发出评论请求"""
+        if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+            route.abort()
+        else:
+            route.continue_()
 
+    def _close_browser(self):
+        """关闭Playwright浏览器"""
+        context, browser, playwright = self._browser_context, self._browser, self._playwright
+        self._browser_context = self._browser = self._playwright = None
+        try:
+            if context is not None:
+                context.close()
+            if browser is not None:
+                browser.close()
+        except Exception as e:
+            logger.debug("关闭浏览器失败: %s", e)
+        finally:
+            # 驱动进程已断开时stop()也可能抛错, 此时浏览器已不可用, 忽略即可
+            try:
+                if playwright is not None:
+                    playwright.stop()
             except Exception as e:
-                if self._stop_event.is_set():
-                    break
-                self._stop_event.wait(timeout=5)
+                logger.debug("停止Playwright失败: %s", e)
+
+    def _get_token(self):
+        """获取签名token, _m_h5_tk未变化时复用上次切分结果"""
+        m_h5_tk = self._m_h5_tk
+        cached_tk, token = self._cached_tk
+        if m_h5_tk != cached_tk:
+            token = m_h5_tk.split('_', 1)[0]
+            self._cached_tk = (m_h5_tk, token)
+        return token
+
+    def make_sign(self, token, t, app_key, data):
+        """生成签名, data可以是str或UTF-8字节串"""
+        cached_token, prefix = self._md5_prefix
+        if prefix is None or cached_token != token:
+            prefix = hashlib.md5(f"{token}&".encode('utf-8'), usedforsecurity=False)
+            self._md5_prefix = (token, prefix)
+        app_key_bytes = self._sign_app_key_bytes.get(app_key)
+        if app_key_bytes is None:
+            app_key_bytes = self._sign_app_key_bytes[app_key] = f"&{app_key}&".encode('utf-8')
+        h = prefix.copy()
+        h.update(str(t).encode('ascii'))
+        h.update(app_key_bytes)
+        h.update(data.encode('utf-8') if isinstance(data, str) else data)
+        return h.hexdigest()
+
+    def _signed_url(self, base_url, app_key, data, token=None):
+        """在预编码的mtop URL后追加本次请求的t/sign/data"""
+        if token is None:
+            token = self._get_token()
+        t = str(int(time.time() * 1000))
+        sign = self.make_sign(token, t, app_key, data)
+        return f"{base_url}&t={t}&sign={sign}&data={quote(data, safe='')}"
+
+    def _sendHeartbeat(self):
+        """发送心跳包 - 统一函数名; 拉取一次powermsg消息, 有新消息时返回True"""
+        data = self._heartbeat_head + _dumps(self._heartbeat_offset) + _HEARTBEAT_DATA_TAIL
+        result = self._mtop_get(_HEARTBEAT_URL, _HEARTBEAT_APP_KEY, data, headers=self._heartbeat_headers)
+
+        data_obj = result.get('data')
+        timestamps = data_obj.get('timestampList') if data_obj else None
+        if not timestamps:
+            return False
+
+        self._heartbeat_offset = timestamps[-1].get('offset') or self._heartbeat_offset
+        with self._batched_output():
+            for timestamp_data in timestamps:
+                self._parse_protobuf_message(timestamp_data)
+        logger.info("【√】发送心跳包")  # 统一输出格式
+        return True
 
     def _parse_protobuf_message(self, timestamp_data):
         """解析protobuf消息"""
@@ -308,6 +572,12 @@ class TaobaoLiveWebFetcher:
             data_b64 = timestamp_data.get('data', '')
             if not data_b64:
                 return
+            seen = self._seen_msg_data
+            if data_b64 in seen:
+                return
+            seen[data_b64] = None
+            if len(seen) > self._seen_msg_data_cap:
+                seen.popitem(last=False)
             
             parsed_result = self.protobuf_parser.parse_base64_message(data_b64)
             if not parsed_result:
@@ -317,7 +587,7 @@ class TaobaoLiveWebFetcher:
                 self._process_message(json_obj)
                 
         except Exception as e:
-            pass
+            logger.debug("处理protobuf消息失败: %s", e)
 
     def _process_message(self, json_obj):
         """处理消息 - 统一接口"""
@@ -325,70 +595,164 @@ class TaobaoLiveWebFetcher:
             if not isinstance(json_obj, dict):
                 return
             
+            # 判断顺序不能调换: 带nick的subType消息按进场消息处理
+            has_sub_type = 'subType' in json_obj
             # 统计信息消息
             if 'viewCountFormat' in json_obj or 'pageViewCount' in json_obj:
                 self._parseRoomUserSeqMsg(json_obj)
             # 用户进入消息
-            elif 'nick' in json_obj and ('flowSourceText' in json_obj or 'subType' in json_obj):
+            elif 'nick' in json_obj and (has_sub_type or 'flowSourceText' in json_obj):
                 self._parseMemberMsg(json_obj)
             # 点赞消息
-            elif 'value' in json_obj and 'dig' in json_obj.get('value', {}):
+            elif isinstance(json_obj.get('value'), dict) and 'dig' in json_obj['value']:
                 self._parseLikeMsg(json_obj)
-            # 其他消息类型
-            elif 'subType' in json_obj:
-                sub_type = json_obj.get('subType', 0)
-                if sub_type == 10001:
-                    self._parseChatMsg(json_obj)
-                elif sub_type == 10002:
-                    self._parseGiftMsg(json_obj)
+            # 其他消息类型, 按subType查表分发
+            elif has_sub_type:
+                handler = self._SUBTYPE_HANDLERS.get(json_obj['subType'])
+                if handler:
+                    getattr(self, handler)(json_obj)
                     
         except Exception as e:
-            pass
+            logger.debug("处理消息失败: %s", e)
 
     def _listen_comments(self):
-        """监听评论"""
+        """监听评论, 心跳在同一线程内穿插发送"""
         while not self._stop_event.is_set():
             try:
                 res = self.fetch_comments()
                 data = res.get('data', {})
-                self._pagination_ctx = data.get('paginationContext')
                 comments = data.get('comments', [])
+                pagination_ctx = data.get('paginationContext')
+                # 分页上下文未推进且没有新评论, 说明评论流空闲
+                ctx_stalled = not comments and pagination_ctx == self._pagination_ctx
+                if isinstance(pagination_ctx, str) and len(pagination_ctx) > self._max_pagination_ctx_len:
+                    pagination_ctx = None
+                self._pagination_ctx = pagination_ctx
                 
-                if comments:
-                    self._last_message_time = time.time()
-                
-                for c in comments:
-                    self._parseChatMsg(c)
+                with self._batched_output():
+                    for c in comments:
+                        if self._is_duplicate_comment(c):
+                            continue
+                        self._parseChatMsg(c)
                 
                 delay = int(data.get('delay', 6000)) / 1000
-                for _ in range(int(delay)):
-                    if self._stop_event.is_set(): 
-                        break
-                    time.sleep(1)
-                    
+                idle_delay = self._adapt_poll_interval(delay, len(comments), ctx_stalled)
+                if not self._wait_next_fetch(delay, idle_delay):
+                    break
+
             except Exception as e:
                 if not self._stop_event.is_set():
                     raise
 
+    def _adapt_poll_interval(self, delay, count, stalled=False):
+        """
+        根据本次拉到的评论数调整空闲时的拉取间隔: 连续空轮询逐步放慢, 评论密集时收紧
+        :param delay: 服务端要求的最小拉取间隔(秒)
+        :param count: 本次拉到的评论数
+        :param stalled: 分页上下文未推进, 重复请求同一上下文意义不大, 放慢得更快
+        :return: 心跳未发现新消息时的拉取间隔(秒)
+        """
+        if count == 0:
+            interval = self._poll_interval * (2 if stalled else 1.5)
+        else:
+            interval = self._poll_interval
+            if count >= self._comment_payload['limit'] // 2:
+                interval /= 2
+        self._poll_interval = min(max(interval, delay), self._comment_fallback_interval)
+        return self._poll_interval
+
+    def _wait_next_fetch(self, delay, idle_delay):
+        """
+        等待下一次评论拉取, 期间按间隔穿插发送心跳
+        :param delay: 服务端要求的最小拉取间隔(秒)
+        :param idle_delay: 心跳未发现新消息时的拉取间隔(秒)
+        :return: 停止监听时返回False
+        """
+        start = time.monotonic()
+        earliest_fetch = start + delay
+        next_fetch = start + max(delay, idle_delay)
+        while True:
+            now = time.monotonic()
+            if now >= self._next_heartbeat_time:
+                self._next_heartbeat_time = now + self._heartbeat_interval
+                try:
+                    # 心跳拉到新消息, 服务端间隔一过就拉取评论
+                    if self._sendHeartbeat():
+                        next_fetch = earliest_fetch
+                except Exception as e:
+                    # 心跳失败不打断评论轮询, 稍后重试
+                    logger.info("【X】心跳请求失败: %s", e)
+                    self._next_heartbeat_time = time.monotonic() + 5
+                now = time.monotonic()
+
+            if now >= next_fetch:
+                return True
+            if self._stop_event.wait(timeout=min(next_fetch, self._next_heartbeat_time) - now):
+                return False
+
+    def _is_duplicate_comment(self, comment):
+        """评论是否已处理过, 未处理过则记录其ID"""
+        cid = comment.get('commentId') or comment.get('id') or (
+            comment.get('publisherId'), comment.get('content'), comment.get('timestamp')
+        )
+        seen = self._seen_comment_ids
+        if cid in seen:
+            return True
+        seen[cid] = None
+        if len(seen) > self._seen_comment_cap:
+            seen.popitem(last=False)
+        return False
+
     def fetch_comments(self):
         """获取评论"""
-        app_key = '34675810'
-        t = str(int(time.time() * 1000))
-        payload = {"topic": self.topic, "limit": 20, "tab": 2, "order": "asc"}
+        payload = self._comment_payload
+        payload["topic"] = self.topic
         if self._pagination_ctx:
             payload["paginationContext"] = self._pagination_ctx
-        data_str = json.dumps(payload, separators=(',', ':'))
-        sign = self.make_sign(self.session.cookies.get('_m_h5_tk', ''), t, app_key, data_str)
-        params = {
-            'jsv': '2.7.2', 'appKey': app_key, 't': t, 'sign': sign,
-            'api': 'mtop.taobao.iliad.comment.query.latest', 'v': '1.0',
-            'preventFallback': 'true', 'type': 'jsonp', 'dataType': 'jsonp',
-            'callback': f'mtopjsonp{random.randint(1,100)}', 'data': data_str
-        }
-        url = 'https://h5api.m.taobao.com/h5/mtop.taobao.iliad.comment.query.latest/1.0/'
-        r = self.session.get(url, params=params, timeout=10)
-        json_str = r.text[r.text.find('(')+1:r.text.rfind(')')]
-        return json.loads(json_str)
+        else:
+            payload.pop("paginationContext", None)
+        return self._mtop_get(_COMMENT_URL, _COMMENT_APP_KEY, _dumps(payload))
+
+    def _mtop_get(self, base_url, app_key, data, headers=None):
+        """签名并发送mtop请求, token被服务端轮换时用新token重签重试一次"""
+        for _ in range(2):
+            url = self._signed_url(base_url, app_key, data)
+            result = self._decode_mtop_response(self.session.get(url, headers=headers, timeout=10))
+            if result is not None:
+                return result
+        raise ValueError("【X】token轮换后仍然失效")
+
+    def _decode_mtop_response(self, resp):
+        """
+        解析mtop响应, 兼容JSON与JSONP两种返回格式
+        :return: 解析结果; token已失效但响应下发了新token时返回None, 由调用方重签重试
+        """
+        rotated = self._update_token(resp)
+        body = resp.content
+        if body.lstrip()[:1] != b'{':
+            body = body[body.find(b'(') + 1:body.rfind(b')')]
+        result = _loads(body)
+        ret = result.get('ret') or []
+        if any(code in r for r in ret for code in _TOKEN_INVALID_CODES):
+            if rotated:
+                return None
+            self._invalidate_cached_creds()
+            raise ValueError(f"【X】token已失效: {ret}")
+        return result
+
+    def _update_token(self, resp):
+        """服务端轮换token时会随响应下发新的_m_h5_tk/_m_h5_tk_enc, 更新签名token与磁盘缓存"""
+        m_h5_tk = resp.cookies.get('_m_h5_tk')
+        if not m_h5_tk or m_h5_tk == self._m_h5_tk:
+            return False
+        self._m_h5_tk = m_h5_tk
+        if self.cookie_dict is not None:
+            self.cookie_dict['_m_h5_tk'] = m_h5_tk
+            m_h5_tk_enc = resp.cookies.get('_m_h5_tk_enc')
+            if m_h5_tk_enc:
+                self.cookie_dict['_m_h5_tk_enc'] = m_h5_tk_enc
+            self._save_cached_creds()
+        return True
 
     # 统一的消息解析函数 - 与抖音版本命名一致
     def _parseChatMsg(self, payload):
@@ -406,7 +770,7 @@ class TaobaoLiveWebFetcher:
             content = payload.get('content', payload.get('text', ''))
         
         if content and not self._is_gift_message(content):
-            print(f"【聊天msg】[{user_id}]{nick}: {content}")
+            self._emit(f"【聊天msg】[{user_id}]{nick}: {content}")
 
     def _parseGiftMsg(self, payload):
         """礼物消息"""
@@ -420,17 +784,17 @@ class TaobaoLiveWebFetcher:
             content = payload.get('content', '')
             gift_name, gift_count = self._extract_gift_info(content)
         
-        print(f"【礼物msg】{nick} 送出了 {gift_name}x{gift_count}")
+        self._emit(f"【礼物msg】{nick} 送出了 {gift_name}x{gift_count}")
 
     def _parseLikeMsg(self, payload):
         """点赞消息"""
         if 'value' in payload:
             dig_count = payload.get('value', {}).get('dig', 1)
-            print(f"【点赞msg】匿名用户 点了{dig_count}个赞")
+            self._emit(f"【点赞msg】匿名用户 点了{dig_count}个赞")
         else:
             count = payload.get('count', 1)
             nick = payload.get('nick', '匿名用户')
-            print(f"【点赞msg】{nick} 点了{count}个赞")
+            self._emit(f"【点赞msg】{nick} 点了{count}个赞")
 
     def _parseMemberMsg(self, payload):
         """进入直播间消息"""
@@ -453,70 +817,82 @@ class TaobaoLiveWebFetcher:
             badges.append(f'粉丝{fan_level}级')
         
         badge_str = '[' + ','.join(badges) + ']' if badges else ''
-        print(f"【进场msg】[{user_id}]{badge_str}{nick} 进入了直播间")
+        self._emit(f"【进场msg】[{user_id}]{badge_str}{nick} 进入了直播间")
 
     def _parseRoomUserSeqMsg(self, payload):
         """直播间统计"""
         current = payload.get('onlineCount', payload.get('current_viewers', 0))
         total = payload.get('totalCount', payload.get('total_viewers', 0))
-        print(f"【统计msg】当前观看人数: {current}, 累计观看人数: {total}")
+        self._emit(f"【统计msg】当前观看人数: {current}, 累计观看人数: {total}")
 
     def _parseSocialMsg(self, payload):
         """关注消息"""
         nick = payload.get('nick', payload.get('user_name', '匿名'))
         user_id = payload.get('userid', payload.get('user_id', '0'))
-        print(f"【关注msg】[{user_id}]{nick} 关注了主播")
+        self._emit(f"【关注msg】[{user_id}]{nick} 关注了主播")
 
     def _parseFansclubMsg(self, payload):
         """粉丝团消息"""
         content = payload.get('content', '粉丝团消息')
-        print(f"【粉丝团msg】 {content}")
+        self._emit(f"【粉丝团msg】 {content}")
 
     def _parseEmojiChatMsg(self, payload):
         """聊天表情包消息"""
         emoji_id = payload.get('emoji_id', '')
         user_name = payload.get('user', {}).get('nick_name', '匿名')
-        print(f"【聊天表情包msg】{user_name} 发送了表情 {emoji_id}")
+        self._emit(f"【聊天表情包msg】{user_name} 发送了表情 {emoji_id}")
 
     def _parseControlMsg(self, payload):
         """直播间状态消息"""
         status = payload.get('status', 0)
         if status == 3:
-            print("直播间已结束")
+            self._emit("直播间已结束")
             self.stop()
 
     def _parseRoomStatsMsg(self, payload):
         """直播间统计信息"""
         display_long = payload.get('display_long', '')
-        print(f"【直播间统计msg】{display_long}")
+        self._emit(f"【直播间统计msg】{display_long}")
 
     def _parseRankMsg(self, payload):
         """直播间排行榜信息"""
         ranks_list = payload.get('ranks_list', [])
-        print(f"【直播间排行榜msg】{ranks_list}")
+        self._emit(f"【直播间排行榜msg】{ranks_list}")
 
     def _parseRoomMsg(self, payload):
         """直播间信息"""
         room_id = payload.get('common', {}).get('room_id', self.live_id)
-        print(f"【直播间msg】直播间id:{room_id}")
+        self._emit(f"【直播间msg】直播间id:{room_id}")
 
     # 辅助函数
+    def _emit(self, text):
+        """输出一条消息, 批量处理期间先缓存"""
+        if self._out_batch is not None:
+            self._out_batch.append(text)
+        else:
+            print(text)
+
+    @contextmanager
+    def _batched_output(self):
+        """一轮消息处理完后一次性输出, 突发大量消息时减少stdout加锁和刷新次数"""
+        self._out_batch = []
+        try:
+            yield
+        finally:
+            batch, self._out_batch = self._out_batch, None
+            if batch:
+                print('\n'.join(batch))
+
     def _safe_int_convert(self, value, default=0):
         """安全的整数转换"""
         try:
-            if isinstance(value, str):
-                return int(value) if value.isdigit() else default
-            elif isinstance(value, (int, float)):
-                return int(value)
-            else:
-                return default
-        except (ValueError, TypeError):
+            return int(value)
+        except (ValueError, TypeError, OverflowError):
             return default
 
     def _is_gift_message(self, content):
         """判断是否为礼物消息"""
-        gift_keywords = ['送出了', '打赏了', '礼物', '小心心', '棒棒糖']
-        return any(keyword in content for keyword in gift_keywords)
+        return _GIFT_RE.search(content) is not None
 
     def _extract_gift_info(self, content):
         """从评论中提取礼物信息"""
@@ -528,10 +904,9 @@ class TaobaoLiveWebFetcher:
             if len(parts) > 1:
                 gift_info = parts[1].strip()
                 # 提取数量
-                import re
-                count_match = re.search(r'(\d+)', gift_info)
+                count_match = _DIGIT_RE.search(gift_info)
                 if count_match:
-                    gift_count = int(count_match.group(1))
-                gift_name = re.sub(r'\d+', '', gift_info).strip()
+                    gift_count = int(count_match.group())
+                gift_name = _DIGIT_RE.sub('', gift_info).strip()
         
         return gift_name, gift_count
@@ -6,10 +6,22 @@
 # @Author:      ztj7728
 # @Project:     TaobaoLiveWebFetcher
 
+import argparse
+import logging
+
 from liveMan import TaobaoLiveWebFetcher
 
 if __name__ == '__main__':
-    live_id = '529180182626'
-    room = TaobaoLiveWebFetcher(live_id)
+    parser = argparse.ArgumentParser(description='淘宝直播间弹幕抓取')
+    parser.add_argument('live_id', nargs='?', default='529180182626', help='直播间ID或URL')
+    parser.add_argument('-v', '--verbose', action='count', default=0, help='输出心跳、重连等运行日志, -vv输出调试日志')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level={0: logging.WARNING, 1: logging.INFO}.get(args.verbose, logging.DEBUG),
+        format='%(asctime)s %(levelname)s %(message)s'
+    )
+
+    room = TaobaoLiveWebFetcher(args.live_id)
     room.get_room_status()
     room.start()